@@ -112,7 +112,7 @@ class Plugin(pwem.Plugin):
                 'cmake ../ -DCMAKE_INSTALL_PREFIX=../../eigen_lib && make install && ',
                 'cd ../../../ && mkdir bin && cd bin && cmake .. && ',
                 f'make -j {env.getProcessors()} && make prepare_python && ',
-                'cd .. && pip install -e .'
+                'cd .. && pip install -e . mrcfile orjson'
             ]
 
             susanCmds = [(" ".join(installCmds), 'bin/susan_aligner_mpi')]
@@ -77,7 +77,8 @@ class ProtSusanBase(EMProtocol):
             'outavg': self._getExtraPath('average_class%(ref3d)03d.mrc'),
             'outavg_half1': self._getExtraPath('average_class%(ref3d)03d_half1.mrc'),
             'outavg_half2': self._getExtraPath('average_class%(ref3d)03d_half2.mrc'),
-            'info': self._getExtraPath('mra/info.pkl')
+            'info': self._getExtraPath('mra/info.pkl'),
+            'info_npz': iterDir + '/info.npz'
         })
 
     def _createIterTemplates(self):
@@ -32,11 +32,14 @@ inside its conda environment.
 
 import os
 import sys
-import json
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
 
 import susan as SUSAN
 
-from base import createTomosFile, createPtclsFile
+from base import createTomosFile, createPtclsFile, waitForSaves
 
 
 def reconstructAvg(params):
@@ -59,11 +62,12 @@ if __name__ == '__main__':
 
         if os.path.exists(inputJson):
             with open(inputJson) as fn:
-                params = json.load(fn)
+                params = _json.loads(fn.read())
 
-            createTomosFile(params)
+            tomos = createTomosFile(params)
             if not params['continue']:
-                createPtclsFile(params, n_refs=1)
+                createPtclsFile(params, n_refs=1, tomos=tomos)
+            waitForSaves()
             reconstructAvg(params)
         else:
             raise FileNotFoundError(inputJson)
@@ -30,57 +30,114 @@ This script should be launched using the SUSAN python interpreter
 inside its conda environment.
 """
 
+import os
 import re
-from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache
 import numpy as np
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+try:
+    import mrcfile
+except ImportError:
+    mrcfile = None
 
 import susan as SUSAN
 
+# tomostxt files are written in the background, see waitForSaves
+_SAVE_POOL = ThreadPoolExecutor(max_workers=1)
+_pendingSaves = []
+
+_ITE_RE = re.compile(r'ite_(\d{4})')
+
+# DYNAMO table columns used: tag, tomo, x, y, z
+DYN_COLUMNS = (0, 19, 23, 24, 25)
+
 
 def createTomosFile(params):
     """ Create tomostxt file. """
-    n_tomo = len(params['ts_nums'])
+    ts_nums = params['ts_nums']
+    n_tomo = len(ts_nums)
+    if n_tomo == 1:
+        tomos_file = f"tomo{ts_nums[0]}.tomostxt"
+    else:
+        tomos_file = "input/input_tomos.tomostxt"
+
     tomos = SUSAN.data.Tomograms(n_tomo=n_tomo,
                                  n_proj=params['num_tilts'])
+    stacks = params['inputStacks']
+    angles = params['inputAngles']
+    # angle files are always named *.tlt
+    defoci = [os.path.splitext(a)[0] + ".defocus" for a in angles]
+    tomo_size = tuple(params['tomo_size'])
+
     for i in range(n_tomo):
-        tomos.tomo_id[i] = params['ts_nums'][i]
-        tomos.set_stack(i, params['inputStacks'][i])
-        tomos.set_angles(i, params['inputAngles'][i])
+        tomos.tomo_id[i] = ts_nums[i]
+        tomos.set_stack(i, stacks[i])
+        tomos.set_angles(i, angles[i])
         tomos.pix_size[i] = params['pix_size']
-        tomos.tomo_size[i] = tuple(params['tomo_size'])
+        tomos.tomo_size[i] = tomo_size
         tomos.voltage[i] = params['voltage']
         tomos.amp_cont[i] = params['amp_cont']
         tomos.sph_aber[i] = params['sph_aber']
         if params['has_ctf']:
-            tomos.set_defocus(i, params['inputAngles'][i].replace(".tlt", ".defocus"))
+            tomos.set_defocus(i, defoci[i])
 
-    if n_tomo == 1:
-        output = f"tomo{params['ts_nums'][0]}.tomostxt"
+    _pendingSaves.append(_SAVE_POOL.submit(tomos.save, tomos_file))
+
+    return tomos
+
+
+def waitForSaves():
+    """ Block until all tomostxt files have been written to disk. """
+    while _pendingSaves:
+        _pendingSaves.pop().result()
+
+
+def readDynTable(path):
+    """ Read only the required columns of a DYNAMO table
+    into a (N, len(DYN_COLUMNS)) array.
+    """
+    if pd is not None:
+        parts = pd.read_csv(path, sep=r'\s+', header=None,
+                            usecols=list(DYN_COLUMNS),
+                            engine='c').to_numpy(dtype=np.float64)
     else:
-        output = "input/input_tomos.tomostxt"
+        parts = np.loadtxt(path, usecols=DYN_COLUMNS, ndmin=2)
 
-    tomos.save(output)
+    return parts
 
 
-def createPtclsFile(params, n_refs, do_continue=False):
-    """ Load DYNAMO table with NUMPY and convert it to PTCLSRAW. """
+def createPtclsFile(params, n_refs, do_continue=False, tomos=None):
+    """ Load DYNAMO table with NUMPY and convert it to PTCLSRAW.
+    Tomograms returned by createTomosFile can be passed to avoid
+    reading the tomostxt file again.
+    """
+    ptcls_file = "input/input_particles.ptclsraw"
     if do_continue:
-        ptcls = SUSAN.data.Particles(filename="input/input_particles.ptclsraw")
+        ptcls = SUSAN.data.Particles(filename=ptcls_file)
     else:
-        parts = np.loadtxt("../tmp/input_particles.tbl", unpack=True)
-        tomos = SUSAN.read("input/input_tomos.tomostxt")
+        parts = readDynTable("../tmp/input_particles.tbl")
+        if tomos is None:
+            waitForSaves()
+            tomos = SUSAN.read("input/input_tomos.tomostxt")
         randomize = params.get("randomize", False)
+        # C-contiguous (N, 3) positions, avoids a strided copy on import
+        position = np.ascontiguousarray(parts[:, 2:5], dtype=np.float32)
         ptcls = SUSAN.data.Particles.import_data(tomograms=tomos,
-                                                 position=parts[23:26, :].transpose(),
-                                                 ptcls_id=parts[0],
-                                                 tomos_id=parts[19],
+                                                 position=position,
+                                                 ptcls_id=parts[:, 0].astype(np.int32),
+                                                 tomos_id=parts[:, 1].astype(np.int32),
                                                  randomize_angles=randomize)
     # Duplicate reference indexes
     if n_refs > 1:
         for _ in range(n_refs-1):
             SUSAN.data.Particles.MRA.duplicate(ptcls, 0)
 
-    ptcls.save("input/input_particles.ptclsraw")
+    ptcls.save(ptcls_file)
 
 
 def createRefsFile(params, n_refs):
@@ -94,33 +151,66 @@ def createRefsFile(params, n_refs):
     refs.save("input/input_refs.refstxt")
 
 
+@lru_cache(maxsize=64)
+def getFsc(mngr, ite, ref=1):
+    """ Return the FSC curve of an iteration, cached to avoid re-reading it. """
+    return mngr.get_fsc(ite=ite, ref=ref)
+
+
 def postProcess(params, mngr, n_refs=1, iter=1):
     """ Apply FOM or l0 filter to output maps. """
     maps = [mngr.get_names_map(iter, ref=i) for i in range(1, n_refs+1)]
 
     for fn in maps:
-        v, apix = SUSAN.io.mrc.read(fn)
-        res = [v]
-        if params['apply_fom']:
-            # Denoise reference with FOM [Sindelar and Grigorieff, 2012]
-            v_f = SUSAN.utils.apply_FOM(res[-1], mngr.get_fsc(iter))
-            res.append(v_f)
-        if params['apply_l0']:
-            # l0-norm: Using M-sparse constraint [Blumensath and Davies, 2008]
-            v_f = SUSAN.utils.denoise_l0(res[-1], l0_lambda=0.05)
-            res.append(v_f)
+        if mrcfile is not None:
+            # Map the volume instead of reading it, pages are loaded on demand
+            with mrcfile.mmap(fn, mode='r', permissive=True) as mrc:
+                v = denoiseMap(params, mngr, np.asarray(mrc.data), iter)
+                apix = float(mrc.voxel_size.x)
+        else:
+            v, apix = SUSAN.io.mrc.read(fn)
+            v = denoiseMap(params, mngr, v, iter)
+
         fn = fn.replace(".mrc", "_denoised.mrc")
-        SUSAN.io.mrc.write(res[-1], fn, apix)
-        del res
+        if mrcfile is not None:
+            with mrcfile.new_mmap(fn, shape=v.shape, mrc_mode=2,
+                                  overwrite=True) as out:
+                for z in range(v.shape[0]):
+                    out.data[z] = v[z]
+                out.update_header_stats()
+                out.voxel_size = apix
+        else:
+            SUSAN.io.mrc.write(v, fn, apix)
+
+
+def denoiseMap(params, mngr, v, iter):
+    """ Return the volume filtered as requested in params. """
+    if params['apply_fom']:
+        # Denoise reference with FOM [Sindelar and Grigorieff, 2012]
+        v = SUSAN.utils.apply_FOM(v, getFsc(mngr, iter, 1))
+    if params['apply_l0']:
+        # l0-norm: Using M-sparse constraint [Blumensath and Davies, 2008]
+        v = SUSAN.utils.denoise_l0(v, l0_lambda=0.05)
+
+    return v
+
+
+def _iterEntries(pattern):
+    """ Yield (iteration number, path) for paths matching e.g. 'mra/ite_*'.
+    Only the last path component may contain wildcards.
+    """
+    dirname, basename = os.path.split(pattern)
+    if not os.path.isdir(dirname or "."):
+        return
+
+    with os.scandir(dirname or ".") as entries:
+        for entry in entries:
+            if fnmatch(entry.name, basename):
+                s = _ITE_RE.search(entry.name)
+                if s:
+                    yield int(s.group(1)), os.path.join(dirname, entry.name)
 
 
 def getIterNumber(path):
     """ Return the last iteration number. """
-    result = None
-    files = sorted(glob(path))
-    if files:
-        f = files[-1]
-        s = re.compile(r'ite_(\d{4})').search(f)
-        if s:
-            result = int(s.group(1))  # group 1 is 1 digit iteration number
-    return result
+    return max((n for n, _ in _iterEntries(path)), default=None)
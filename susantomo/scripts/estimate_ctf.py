@@ -32,16 +32,21 @@ inside its conda environment.
 
 import os
 import sys
-import json
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
 
 import susan as SUSAN
 
-from base import createTomosFile
+from base import createTomosFile, waitForSaves
 
 
-def create2DGrid(params, ts_id):
+def create2DGrid(params, ts_id, tomos=None):
     """ Create a 2D grid to estimate the CTF. """
-    tomos = SUSAN.read(f"tomo{ts_id}.tomostxt")
+    if tomos is None:
+        waitForSaves()
+        tomos = SUSAN.read(f"tomo{ts_id}.tomostxt")
     grid = SUSAN.data.Particles.grid_2d(tomos, step_pixels=params['sampling'])
     grid.save("grid_ctf.ptclsraw")
 
@@ -66,11 +71,12 @@ if __name__ == '__main__':
 
         if os.path.exists(inputJson):
             with open(inputJson) as fn:
-                params = json.load(fn)
+                params = _json.loads(fn.read())
                 ts_id = params['ts_nums'][0]
 
-            createTomosFile(params)
-            create2DGrid(params, ts_id)
+            tomos = createTomosFile(params)
+            create2DGrid(params, ts_id, tomos=tomos)
+            waitForSaves()
             estimateCtf(params, ts_id)
         else:
             raise FileNotFoundError(inputJson)
@@ -32,13 +32,26 @@ inside its conda environment.
 
 import os
 import sys
-import json
-import pickle
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
 import numpy as np
 
 import susan as SUSAN
 
-from base import postProcess, createPtclsFile, createTomosFile, createRefsFile
+from base import (postProcess, createPtclsFile, createTomosFile,
+                  createRefsFile, getFsc, waitForSaves)
+
+
+def getIterResults(mngr, ite, n_refs):
+    """ Return FSC and CC dicts {ref: array} of an iteration.
+    The particles file is read once for all references. """
+    ptcls = SUSAN.data.Particles(filename=mngr.get_names_ptcls(ite))
+    fsc = {n: getFsc(mngr, ite, n) for n in range(1, n_refs+1)}
+    cc = {n: ptcls.ali_cc[n-1] for n in range(1, n_refs+1)}
+
+    return fsc, cc
 
 
 def runAlignment(params):
@@ -71,37 +84,35 @@ def runAlignment(params):
     auto = params['auto_step']
     lp = params['low']
     n_refs = params['refs_nums']
-    fsc = {}
-    cc = {}
+    is_multi = n_refs > 1
+    aligner = mngr.aligner
+    bandpass = aligner.bandpass
+    prev_ang = None
 
     for i in range(1, params['iter'] + 1):
         if auto:  # adjust angular range/step every iter
             ang_stp = np.rad2deg(np.arctan2(1, lp))
             ang_rng = params['range_factor'] * ang_stp
-            if i > 1:
-                mngr.aligner.set_angular_search(ang_rng, ang_stp, ang_rng, ang_stp)
+            if i > 1 and (ang_rng, ang_stp) != prev_ang:
+                aligner.set_angular_search(ang_rng, ang_stp, ang_rng, ang_stp)
+                prev_ang = (ang_rng, ang_stp)
                 if params['refine'] == 0:
-                    mngr.aligner.refine.levels = 1
-        mngr.aligner.bandpass.lowpass = lp
+                    aligner.refine.levels = 1
+        bandpass.lowpass = lp
         bp = mngr.execute_iteration(i)
-        if n_refs > 1:
-            bp = max(max(bp), 1.0)  # avoid 0.0
+        if is_multi:
+            bp = max(1.0, *bp)  # avoid 0.0
+        bp = float(bp)
         if i == 1 or not inc_lp:
             lp = params['low']  # keep const
         else:
             # Enforce a gradual increase in the lowpass
             lp = min(lp + 2, bp)
-        # save FSC and CC
-        for n in range(1, n_refs+1):
-            if n not in fsc:
-                fsc[n] = [mngr.get_fsc(ite=i, ref=n)]
-                cc[n] = [mngr.get_cc(ite=i, ref=n)]
-            else:
-                fsc[n].append(mngr.get_fsc(ite=i, ref=n))
-                cc[n].append(mngr.get_cc(ite=i, ref=n))
-
-        with open('mra/info.pkl', 'wb') as f:
-            pickle.dump([fsc, cc], f)
+        # save FSC and CC of this iteration for the viewer
+        fsc, cc = getIterResults(mngr, i, n_refs)
+        np.savez(f"mra/ite_{i:04d}/info.npz",
+                 **{f"frc_r{n}": fsc[n] for n in fsc},
+                 **{f"cc_r{n}": cc[n] for n in cc})
 
         if params['apply_fom'] or params['apply_l0']:
             postProcess(params, mngr, n_refs=n_refs, iter=i)
@@ -113,14 +124,16 @@ if __name__ == '__main__':
 
         if os.path.exists(inputJson):
             with open(inputJson) as fn:
-                params = json.load(fn)
+                params = _json.loads(fn.read())
 
-            createTomosFile(params)
+            tomos = createTomosFile(params)
 
             if not params['reuse_refs']:
                 createRefsFile(params, params['refs_nums'])
 
-            createPtclsFile(params, params['refs_nums'], params['continue'])
+            createPtclsFile(params, params['refs_nums'], params['continue'],
+                            tomos=tomos)
+            waitForSaves()
             runAlignment(params)
         else:
             raise FileNotFoundError(inputJson)
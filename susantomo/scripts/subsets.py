@@ -32,7 +32,10 @@ inside its conda environment.
 
 import os
 import sys
-import json
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
 import numpy as np
 
 import susan as SUSAN
@@ -40,27 +43,23 @@ import susan as SUSAN
 
 def createSubsets(params):
     parts = SUSAN.data.Particles(filename=params['input_parts'])
-    results = [parts]
 
     if params['select_refs']:
         for ref in params['refs_list']:
-            res = SUSAN.data.Particles.MRA.select_ref(results[-1], ref-1)
-            results.append(res)
+            parts = SUSAN.data.Particles.MRA.select_ref(parts, ref-1)
 
     if params['do_thr_cc']:
-        nrefs_remaining = results[-1].n_refs
-        for i in range(nrefs_remaining):
-            ind = np.logical_and(results[-1].ali_cc[i] > params['cc_min'],
-                                 results[-1].ali_cc[i] < params['cc_max'])
-            # check if all values are False
-            if np.all(ind == False):
-                raise RuntimeError("CC limits are too strict, no particles match.")
-            res = results[-1].select(ind)
-            results.append(res)
+        # keep particles within CC limits for all remaining references
+        cc = np.ascontiguousarray(parts.ali_cc)  # (n_refs, n_ptcl)
+        ind = cc > params['cc_min']
+        ind &= cc < params['cc_max']  # in-place, reuses the mask buffer
+        ind = ind.all(axis=0)
+        if not ind.any():
+            raise RuntimeError("CC limits are too strict, no particles match.")
+        parts = parts.select(ind)
 
-    print("Remaining particles: ", results[-1].n_ptcl)
-    results[-1].save('particles.ptclsraw')
-    del results
+    print("Remaining particles: ", parts.n_ptcl)
+    parts.save('particles.ptclsraw')
 
 
 if __name__ == '__main__':
@@ -69,7 +68,7 @@ if __name__ == '__main__':
 
         if os.path.exists(inputJson):
             with open(inputJson) as fn:
-                params = json.load(fn)
+                params = _json.loads(fn.read())
             createSubsets(params)
         else:
             raise FileNotFoundError(inputJson)
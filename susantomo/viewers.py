@@ -23,9 +23,8 @@
 # *  e-mail address 'scipion@cnb.csic.es'
 # *
 # **************************************************************************
-import pickle
 import os
-from matplotlib.figure import Figure
+import numpy as np
 
 import pyworkflow.protocol.params as params
 from pyworkflow.viewer import DESKTOP_TKINTER
@@ -41,22 +40,24 @@ from .constants import (ITER_LAST, ITER_SELECTION, CLS_SELECTION, CLS_ALL,
 from .protocols import ProtSusanEstimateCtf, ProtSusanMRA
 
 
+_TITLE_FMT = u"Def1: %d \u212B | Def2: %d \u212B | Angle: %0.1f\u00b0 | "
+_PHASE_FMT = u"Phase shift: %0.2f \u00b0 | "
+_FIT_FMT = u"Fit: %0.1f \u212B | Score: %0.3f"
+
+
 def getPlotSubtitle(ctf):
     """ Create plot subtitle using CTF values. """
-    ang = u"\u212B"
-    deg = u"\u00b0"
     def1, def2, angle = ctf.getDefocus()
     phSh = ctf.getPhaseShift()
     score = ctf.getFitQuality()
     res = ctf.getResolution()
 
-    title = "Def1: %d %s | Def2: %d %s | Angle: %0.1f%s | " % (
-        def1, ang, def2, ang, angle, deg)
+    title = _TITLE_FMT % (def1, def2, angle)
 
     if phSh is not None:
-        title += "Phase shift: %0.2f %s | " % (phSh, deg)
+        title += _PHASE_FMT % phSh
 
-    title += "Fit: %0.1f %s | Score: %0.3f" % (res, ang, score)
+    title += _FIT_FMT % (res, score)
 
     return title
 
@@ -65,21 +66,46 @@ class CtfEstimationTomoViewerSusan(CtfEstimationTomoViewer):
     _targets = [ProtSusanEstimateCtf]
 
     def plot2D(self, ctfSet, ctfId):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
         ctfModel = ctfSet[ctfId]
         index, psdFn = ctfModel.getPsdFile().split("@")
         if not os.path.exists(psdFn):
             return None
         img = ImageHandler().read((int(index), psdFn))
+        # decimate large PSDs, the figure is only 700 px wide
+        data = img.getData()
+        step = max(1, max(data.shape) // 1024)
+        data = np.ascontiguousarray(data[::step, ::step])
+
         fig = Figure(figsize=(7, 7), dpi=100)
+        FigureCanvasAgg(fig)  # render off-screen without pyplot state
         psdPlot = fig.add_subplot(111)
         psdPlot.get_xaxis().set_visible(False)
         psdPlot.get_yaxis().set_visible(False)
         psdPlot.set_title('%s # %d\n' % (ctfSet.getTsId(), ctfId) + getPlotSubtitle(ctfModel))
-        psdPlot.imshow(img.getData(), cmap='gray')
+        psdPlot.imshow(data, cmap='gray', interpolation='nearest')
 
         return fig
 
 
+def readInfo(fn):
+    """ Read FSC and CC curves saved by older versions of the MRA script.
+    Return two dicts {ref3d: [array per iteration]}.
+    """
+    import pickle
+    with open(fn, "rb", buffering=1 << 20) as f:  # fewer reads while unpickling
+        return pickle.load(f)
+
+
+def listFiles(path):
+    """ Return the set of file names in a folder (empty if missing). """
+    if not os.path.isdir(path):
+        return set()
+    with os.scandir(path) as entries:
+        return {e.name for e in entries if e.is_file()}
+
+
 def protected_show(showFunc):
     def protectedShowFunc(self, paramName=None):
         try:
@@ -100,6 +126,9 @@ class MRAViewer(EmProtocolViewer):
 
     def __init__(self, **kwargs):
         EmProtocolViewer.__init__(self, **kwargs)
+        self._info = None
+        self._infoMtime = None
+        self._loadKey = None
 
     def _defineParams(self, form):
         form.addSection(label='Visualization')
@@ -200,12 +229,14 @@ class MRAViewer(EmProtocolViewer):
         extra = prot._getExtraPath()
         cmdFile = prot._getExtraPath('chimera_volumes.cxc')
 
+        # _getVolumeNames only returns existing volumes, usually inside extra
+        prefix = os.path.normpath(extra) + os.sep
+        lines = ["open %s\n" % (vol[len(prefix):] if vol.startswith(prefix)
+                                else os.path.relpath(vol, extra))
+                 for vol in volumes]
+        lines.append('tile\n')
         with open(cmdFile, 'w+') as f:
-            for vol in volumes:
-                localVol = os.path.relpath(vol, extra)
-                if os.path.exists(vol):
-                    f.write("open %s\n" % localVol)
-            f.write('tile\n')
+            f.write("".join(lines))
 
         view = ChimeraView(cmdFile)
 
@@ -232,23 +263,25 @@ class MRAViewer(EmProtocolViewer):
                               addButton=True)
         fscSet = self.protocol._createSetOfFSCs()
         pixSize = self.protocol._getInputTs().getSamplingRate()
-        fn = self.protocol._getFileName("info")
-        if not os.path.exists(fn):
-            raise FileNotFoundError(f"File {fn} does not exist.")
-        with open(fn, "rb") as fn:
-            frc = pickle.load(fn)[0]
-            for it in self._iterations:
-                for ref3d in self._refsList:
-                    fsc = self._plotFSC(frc, it, pix=pixSize, ref3d=ref3d)
-                    fscSet.append(fsc)
+        resolution_inv, size = [], None
+        for it in self._iterations:
+            for ref3d in self._refsList:
+                frc = np.asarray(self._getIterData('frc', it, ref3d))
+                # keep at most ~2048 points, more than the plot can show
+                stride = max(1, frc.size // 2048)
+                if frc.size != size:  # same for all curves
+                    size = frc.size
+                    resolution_inv = (np.arange(size) /
+                                      (2 * pixSize * (size - 1)))[::stride].tolist()
+                fsc = self._plotFSC(frc[::stride], resolution_inv, it, ref3d=ref3d)
+                fscSet.append(fsc)
         fscViewer.visualize(fscSet)
         return [fscViewer]
 
-    def _plotFSC(self, frc, iter, pix=1.0, ref3d=1):
+    def _plotFSC(self, frc, resolution_inv, iter, ref3d=1):
         print(f"Loading FSC for iteration {iter}, reference {ref3d}")
-        frc = frc[ref3d][iter-1]  # iters are 0-indexed
-        resolution_inv = [fpix/(2*pix*(frc.size-1)) for fpix in range(frc.size)]
         fsc = FSC(objLabel=f"iter {iter} ref{ref3d}")
+        # FSC stores the data in CsvList, which needs Python floats
         fsc.setData(resolution_inv, frc.tolist())
 
         return fsc
@@ -256,32 +289,62 @@ class MRAViewer(EmProtocolViewer):
     # ----------------------------- Show CC -----------------------------------
     @protected_show
     def _showCC(self, paramName=None):
-        fn = self.protocol._getFileName('info')
         result = []
-        if not os.path.exists(fn):
-            raise FileNotFoundError(f"File {fn} does not exist.")
-        with open(fn, "rb") as fn:
-            cc = pickle.load(fn)[1]
-            for ref3d in self._refsList:
-                lastIter = len(cc[ref3d])
-                print(f"Loading CC for iteration {lastIter}, reference {ref3d}")
-                result.append(cc[ref3d][lastIter-1].tolist())
-
-        numberOfBins = self.nBins.get()
+        lastIter = self.protocol._lastIter()
+        if lastIter is None:
+            raise FileNotFoundError("No iteration results found in "
+                                    f"{self.protocol._getExtraPath()}.")
+        for ref3d in self._refsList:
+            print(f"Loading CC for iteration {lastIter}, reference {ref3d}")
+            result.append(np.ravel(self._getIterData('cc', lastIter, ref3d)))
+
+        # same bin edges for all references
+        bins = np.histogram_bin_edges(np.concatenate(result),
+                                      bins=self.nBins.get())
         plotter = EmPlotter()
-        plotter.createSubPlot(f"Cross-correlation (iter {lastIter})",
-                              "CC", "Number of particles")
+        ax = plotter.createSubPlot(f"Cross-correlation (iter {lastIter})",
+                                   "CC", "Number of particles")
 
+        # one filled step artist per reference instead of one bar per bin,
+        # drawn in reference order so ref 1 stays at the bottom
         cmap = get_cmap(len(result))
-        for i, r in enumerate(result):
-            plotter.plotHist(r, nbins=numberOfBins, color=cmap(i))
+        for i, (ref3d, r) in enumerate(zip(self._refsList, result)):
+            ax.hist(r, bins=bins, histtype='stepfilled', color=cmap(i),
+                    label=f"ref {ref3d}")
 
-        plotter.showLegend([f"ref {ref3d}" for ref3d in self._refsList], loc='upper right')
+        ax.legend(loc='upper right')
         plotter.show()
 
         return [plotter]
 
     # ------------------------------ Utils funcs ------------------------------
+    def _getIterData(self, key, it, ref3d):
+        """ Return the FSC ('frc') or CC ('cc') array of an iteration and
+        class. Only the requested array is read from the iteration npz file,
+        runs made by older plugin versions fall back to the info pickle.
+        """
+        fn = self.protocol._getFileName('info_npz', iter=it)
+        if os.path.exists(fn):
+            with np.load(fn) as data:
+                return data[f"{key}_r{ref3d}"]
+
+        frc, cc = self._loadInfo()
+        return (frc if key == 'frc' else cc)[ref3d][it-1]  # iters are 0-indexed
+
+    def _loadInfo(self):
+        """ Return FSC and CC dicts from the legacy info pickle.
+        The file is only read again if it has changed on disk.
+        """
+        fn = self.protocol._getFileName("info")
+        if not os.path.exists(fn):
+            raise FileNotFoundError(f"File {fn} does not exist.")
+        mtime = os.path.getmtime(fn)
+        if self._info is None or mtime != self._infoMtime:
+            self._info = readInfo(fn)
+            self._infoMtime = mtime
+
+        return self._info
+
     def _getFigure(self):
         return None if self.figure == 0 else 'active'
 
@@ -295,12 +358,17 @@ class MRAViewer(EmProtocolViewer):
         else:
             keysFn = ["outvol"]
 
+        # list each iteration folder once instead of a stat per volume
+        existing = {}
+        getFileName = self.protocol._getFileName
         for it in self._iterations:
             for ref3d in self._refsList:
                 for key in keysFn:
-                    volFn = self.protocol._getFileName(key,
-                                                       iter=it, ref3d=ref3d)
-                    if os.path.exists(volFn):
+                    volFn = getFileName(key, iter=it, ref3d=ref3d)
+                    dirName, baseName = os.path.split(volFn)
+                    if dirName not in existing:
+                        existing[dirName] = listFiles(dirName)
+                    if baseName in existing[dirName]:
                         vols.append(volFn)
                     else:
                         raise FileNotFoundError(f"Volume {volFn} does not exist.\n"
@@ -311,9 +379,17 @@ class MRAViewer(EmProtocolViewer):
         return vols
 
     def _load(self):
-        """ Load selected iterations and classes for visualization. """
-        self._refsList = [1]
+        """ Load selected iterations and classes for visualization.
+        Results are reused while the selection does not change and
+        the protocol is finished (no new iterations can appear).
+        """
         self._errors = []
+        loadKey = (self.viewIter.get(), self.iterSelection.get(),
+                   self.showClasses3D.get(), self.class3DSelection.get())
+        if loadKey == self._loadKey:
+            return
+
+        self._refsList = [1]
         prot = self.protocol
 
         if self.showClasses3D == CLS_ALL:
@@ -328,6 +404,9 @@ class MRAViewer(EmProtocolViewer):
         else:
             self._iterations = self._getRange(self.iterSelection, 'iterations')
 
+        if not self._errors and prot.isFinished():
+            self._loadKey = loadKey
+
     def _getRange(self, var, label):
         """ Check if the range is not empty.
         :param var: The variable to retrieve the value
@@ -345,14 +424,15 @@ class MRAViewer(EmProtocolViewer):
 
 
 def get_cmap(N):
-    import matplotlib.cm as cmx
-    import matplotlib.colors as colors
     """Returns a function that maps each index in 0, 1, ... N-1 to a distinct
     RGB color."""
+    import matplotlib.cm as cmx
+    import matplotlib.colors as colors
     color_norm = colors.Normalize(vmin=0, vmax=N)  # -1)
     scalar_map = cmx.ScalarMappable(norm=color_norm, cmap='hsv')
+    table = scalar_map.to_rgba(np.arange(N))  # all colors in one call
 
     def map_index_to_rgb_color(ind):
-        return scalar_map.to_rgba(ind)
+        return tuple(table[ind])
 
     return map_index_to_rgb_color